@@ -1,8 +1,12 @@
-from flask import Flask, jsonify, request, session, render_template, redirect, url_for
+from flask import Flask, Response, jsonify, request, session, render_template, redirect, url_for
 from dotenv import load_dotenv
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.test import EnvironBuilder
+import click
 import time
 import backend.database as db
+import backend.feeds as feeds
+from backend.templating import init_template_cache
 import os 
 import datetime
 
@@ -10,6 +14,7 @@ load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY")
+init_template_cache(app)
 
 @app.before_request
 def before_first_request():
@@ -20,6 +25,20 @@ def before_first_request():
         app.db_initialized = True
 
 
+@app.before_request
+def load_last_write():
+    """Dopo una scrittura le letture della sessione restano sul primario"""
+    db.set_last_write(session.get('last_write_at'))
+
+
+@app.after_request
+def save_last_write(response):
+    last_write = db.get_last_write()
+    if last_write and last_write != session.get('last_write_at'):
+        session['last_write_at'] = last_write
+    return response
+
+
 @app.route('/')
 def home():
     # Se l'utente è loggato, vai al calendario
@@ -179,7 +198,8 @@ def profile():
     if not user:
         return redirect(url_for('login'))
     
-    return render_template('profile.html', user=user, oggi=oggi)
+    feed_url = feed_urls(user_id)['user']
+    return render_template('profile.html', user=user, oggi=oggi, feed_url=feed_url)
 
 
 @app.route('/users/<int:user_id>/change-password', methods=['POST'])
@@ -346,6 +366,25 @@ def bookings():
         return jsonify({'error': 'Errore nella creazione della prenotazione'}), 500
 
 
+@app.route('/bookings/summary', methods=['GET'])
+def bookings_summary():
+    # Riepilogo per giorno: numero prenotazioni, minuti occupati e giochi
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+
+    if not start_date or not end_date:
+        return jsonify({'error': 'start_date e end_date sono richiesti'}), 400
+
+    summary = db.get_booking_summary(start_date, end_date)
+
+    # Serializza le date per JSON
+    for day in summary:
+        if day.get('booking_date'):
+            day['booking_date'] = day['booking_date'].isoformat()
+
+    return jsonify(summary)
+
+
 @app.route('/bookings/<int:booking_id>', methods=['DELETE'])
 def delete_booking(booking_id):
     user_id = session.get('user_id')
@@ -375,5 +414,139 @@ def user_bookings(user_id):
     return jsonify(bookings)
 
 
+# ===== ROUTES FEED ICALENDAR =====
+
+def feed_urls(user_id):
+    """URL (con token) dei feed a cui un utente può iscriversi"""
+    user_key = f'user:{user_id}'
+    return {
+        'user': url_for('user_feed', user_id=user_id,
+                        token=feeds.feed_token(app.secret_key, user_key), _external=True),
+        'games': {
+            game: url_for('game_feed', game=game,
+                          token=feeds.feed_token(app.secret_key, f'game:{game}'), _external=True)
+            for game in feeds.GAME_NAMES
+        }
+    }
+
+
+def feed_response(feed_key, load_bookings, render):
+    """Risponde con un feed iCalendar dalla cache, con ETag e 304 se il client è aggiornato"""
+    if not feeds.check_feed_token(app.secret_key, feed_key, request.args.get('token')):
+        return jsonify({'error': 'Feed non trovato'}), 404
+
+    feed = feeds.get_feed(feed_key, load_bookings, render)
+    if feed is None:
+        return jsonify({'error': 'Feed non disponibile'}), 503
+
+    # ETag debole: DTSTAMP e UID cambiano tra una generazione e l'altra,
+    # ma per la stessa versione del feed gli eventi sono gli stessi
+    etag, body = feed
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='text/calendar')
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, max-age=300'
+    return response
+
+
+@app.route('/feeds', methods=['GET'])
+def feed_list():
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'Non autenticato'}), 401
+
+    return jsonify(feed_urls(user_id))
+
+
+@app.route('/feeds/users/<int:user_id>.ics', methods=['GET'])
+def user_feed(user_id):
+    return feed_response(
+        f'user:{user_id}',
+        lambda: db.get_feed_bookings(user_id=user_id),
+        lambda bookings: feeds.build_calendar('Le mie prenotazioni', bookings, request.host)
+    )
+
+
+@app.route('/feeds/games/<game>.ics', methods=['GET'])
+def game_feed(game):
+    if game not in feeds.GAME_NAMES:
+        return jsonify({'error': 'Feed non trovato'}), 404
+
+    return feed_response(
+        f'game:{game}',
+        lambda: db.get_feed_bookings(game=game),
+        lambda bookings: feeds.build_calendar(f'Prenotazioni {feeds.GAME_NAMES[game]}', bookings,
+                                              request.host, with_details=False)
+    )
+
+
+# ===== ROUTE BATCH =====
+
+# Numero massimo di sotto-richieste in una singola chiamata a /batch
+BATCH_MAX_REQUESTS = 10
+
+
+def run_sub_request(sub_request):
+    """Esegue una sotto-richiesta GET nel processo, con i cookie della richiesta corrente"""
+    path = sub_request.get('path') if isinstance(sub_request, dict) else None
+    method = (sub_request.get('method') or 'GET').upper() if isinstance(sub_request, dict) else None
+
+    if not path or not path.startswith('/') or path.startswith('/batch'):
+        return {'path': path, 'status': 400, 'body': {'error': 'Percorso non valido'}}
+    if method != 'GET':
+        return {'path': path, 'status': 405, 'body': {'error': 'Solo richieste GET sono ammesse in un batch'}}
+
+    builder = EnvironBuilder(
+        path=path,
+        method='GET',
+        base_url=request.host_url,
+        headers={'Cookie': request.headers.get('Cookie', '')}
+    )
+    try:
+        with app.request_context(builder.get_environ()):
+            with db.shared_step():
+                response = app.full_dispatch_request()
+    except Exception as e:
+        print(f"Errore nella sotto-richiesta {path}: {e}")
+        return {'path': path, 'status': 500, 'body': {'error': 'Errore interno'}}
+
+    body = response.get_json(silent=True) if response.is_json else response.get_data(as_text=True)
+    return {'path': path, 'status': response.status_code, 'body': body}
+
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    # Esegue più letture in un solo round trip, con una sola connessione
+    # al database e lo stesso snapshot per tutte le sotto-richieste
+    data = request.json
+    sub_requests = data.get('requests') if isinstance(data, dict) else None
+
+    if not isinstance(sub_requests, list) or not sub_requests:
+        return jsonify({'error': 'requests deve essere una lista non vuota'}), 400
+    if len(sub_requests) > BATCH_MAX_REQUESTS:
+        return jsonify({'error': f'Massimo {BATCH_MAX_REQUESTS} richieste per batch'}), 400
+
+    with db.shared_connection():
+        responses = [run_sub_request(sub_request) for sub_request in sub_requests]
+
+    return jsonify({'responses': responses})
+
+
+# ===== COMANDI DI MANUTENZIONE =====
+
+@app.cli.command('archive-bookings')
+@click.option('--months', default=int(os.getenv('BOOKINGS_RETENTION_MONTHS', '24')),
+              help='Mesi di prenotazioni da mantenere nella tabella principale')
+def archive_bookings_command(months):
+    """Crea le partizioni future e archivia quelle più vecchie di --months mesi"""
+    db.ensure_booking_partitions()
+    archived = db.archive_old_bookings(months)
+    for name in archived:
+        click.echo(f"Partizione archiviata: {name}")
+    click.echo(f"{len(archived)} partizioni spostate in {db.ARCHIVE_SCHEMA}")
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
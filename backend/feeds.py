@@ -0,0 +1,157 @@
+import backend.database as db
+from collections import OrderedDict
+import datetime
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+
+# Nomi dei tipi di gioco, come nel form di prenotazione del calendario
+GAME_NAMES = {
+    '18': '18 buche',
+    '18_pg': '18 buche + Pitching Green',
+    '9': '9 buche',
+    '9_pg': '9 buche + Pitching Green',
+}
+
+# Per questi secondi un feed viene servito dalla cache senza interrogare il database
+FEED_VERSION_TTL_SECONDS = float(os.getenv('FEED_VERSION_TTL_SECONDS', '30'))
+# Numero massimo di feed tenuti in memoria da ogni worker
+FEED_CACHE_SIZE = int(os.getenv('FEED_CACHE_SIZE', '1000'))
+FEED_TIMEZONE = os.getenv('FEED_TIMEZONE', 'Europe/Rome')
+
+# Cache dei feed: feed_key -> {'version', 'etag', 'body', 'checked_at'}
+_feeds = OrderedDict()
+_feeds_lock = threading.Lock()
+
+
+def feed_token(secret_key, feed_key):
+    """Token da mettere nell'URL del feed: senza il token il feed non è accessibile"""
+    return hmac.new(secret_key.encode(), feed_key.encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def check_feed_token(secret_key, feed_key, token):
+    """Verifica il token di un feed"""
+    if not secret_key or not token:
+        return False
+    return hmac.compare_digest(feed_token(secret_key, feed_key), token)
+
+
+def get_feed(feed_key, load_bookings, render):
+    """Restituisce (etag, ics) di un feed, oppure None se il database non risponde.
+
+    Il feed viene rigenerato con render(load_bookings()) solo quando la sua versione
+    nel database cambia; la versione stessa viene ricontrollata al massimo ogni
+    FEED_VERSION_TTL_SECONDS. Se load_bookings() fallisce (None) si continua a
+    servire la versione precedente.
+    """
+    now = time.time()
+    with _feeds_lock:
+        entry = _feeds.get(feed_key)
+    if entry and now - entry['checked_at'] < FEED_VERSION_TTL_SECONDS:
+        return entry['etag'], entry['body']
+
+    # Versione e prenotazioni vengono lette dallo stesso snapshot
+    with db.shared_connection():
+        version = db.get_feed_version(feed_key)
+        if version is None:
+            return (entry['etag'], entry['body']) if entry else None
+
+        if entry and entry['version'] == version:
+            entry = dict(entry, checked_at=now)
+        else:
+            bookings = load_bookings()
+            if bookings is None:
+                return (entry['etag'], entry['body']) if entry else None
+            entry = {
+                'version': version,
+                'etag': f'{feed_key}-{version}',
+                'body': render(bookings),
+                'checked_at': now,
+            }
+
+    with _feeds_lock:
+        _feeds[feed_key] = entry
+        _feeds.move_to_end(feed_key)
+        while len(_feeds) > FEED_CACHE_SIZE:
+            _feeds.popitem(last=False)
+    return entry['etag'], entry['body']
+
+
+# ===== FORMATO ICALENDAR (RFC 5545) =====
+
+def _escape(text):
+    return (str(text).replace('\\', '\\\\').replace(';', '\\;')
+            .replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def _fold(line):
+    """Spezza le righe più lunghe di 75 byte, senza tagliare caratteri UTF-8"""
+    parts = []
+    current = ''
+    for char in line:
+        limit = 75 if not parts else 74
+        if len((current + char).encode('utf-8')) > limit:
+            parts.append(current)
+            current = char
+        else:
+            current += char
+    parts.append(current)
+    return '\r\n '.join(parts)
+
+
+def _format_datetime(value):
+    return value.strftime('%Y%m%dT%H%M%S')
+
+
+def build_calendar(name, bookings, uid_domain, with_details=True):
+    """Costruisce un file .ics con un evento per ogni prenotazione.
+
+    Gli orari sono locali della struttura (FEED_TIMEZONE). Con with_details=False
+    titolo e descrizione non vengono inclusi (feed pubblici per tipo di gioco).
+    """
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//My App//Prenotazioni//IT',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{_escape(name)}',
+        f'X-WR-TIMEZONE:{FEED_TIMEZONE}',
+    ]
+
+    for booking in bookings:
+        start = datetime.datetime.combine(booking['booking_date'], booking['start_time'])
+        end = datetime.datetime.combine(booking['booking_date'], booking['end_time'])
+        # Uno slot che finisce a mezzanotte termina il giorno dopo
+        if end <= start:
+            end += datetime.timedelta(days=1)
+
+        game = GAME_NAMES.get(booking.get('game') or '', booking.get('game') or '')
+        if with_details:
+            summary = booking['title']
+            description = '\n'.join(filter(None, [
+                f'Gioco: {game}' if game else None,
+                booking.get('description'),
+            ]))
+        else:
+            summary = f'Campo occupato - {game}' if game else 'Campo occupato'
+            description = None
+
+        lines += [
+            'BEGIN:VEVENT',
+            f"UID:booking-{booking['id']}@{uid_domain}",
+            f'DTSTAMP:{stamp}',
+            f'DTSTART:{_format_datetime(start)}',
+            f'DTEND:{_format_datetime(end)}',
+            f'SUMMARY:{_escape(summary)}',
+        ]
+        if description:
+            lines.append(f'DESCRIPTION:{_escape(description)}')
+        lines.append('END:VEVENT')
+
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(_fold(line) for line in lines) + '\r\n'
@@ -0,0 +1,15 @@
+from jinja2 import FileSystemBytecodeCache
+import os
+
+
+def init_template_cache(app):
+    """Configura la cache del bytecode Jinja per l'app"""
+    # Il bytecode compilato viene salvato su disco e condiviso tra i worker:
+    # un nuovo processo carica i template senza ricompilarli.
+    # Senza TEMPLATE_CACHE_DIR Jinja usa una cartella privata (0700) dell'utente
+    cache_dir = os.getenv('TEMPLATE_CACHE_DIR')
+    if cache_dir:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    else:
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
@@ -0,0 +1,10 @@
+#!/bin/sh
+# Eseguito dall'immagine postgres solo alla prima inizializzazione del volume:
+# crea l'utente di replica e ne abilita l'accesso in streaming
+set -e
+
+psql -v ON_ERROR_STOP=1 --username "$POSTGRES_USER" --dbname "$POSTGRES_DB" <<-EOSQL
+    CREATE ROLE replicator WITH REPLICATION LOGIN PASSWORD '$REPLICATION_PASSWORD';
+EOSQL
+
+echo "host replication replicator all scram-sha-256" >> "$PGDATA/pg_hba.conf"
@@ -0,0 +1,18 @@
+#!/bin/sh
+# Avvia una replica in streaming del servizio "db".
+# Al primo avvio copia i dati del primario con pg_basebackup (-R crea standby.signal).
+set -e
+
+mkdir -p "$PGDATA"
+chown postgres:postgres "$PGDATA"
+chmod 700 "$PGDATA"
+
+if [ ! -s "$PGDATA/PG_VERSION" ]; then
+    until pg_isready -h "$PRIMARY_HOST" -U postgres; do
+        sleep 1
+    done
+    su-exec postgres env PGPASSWORD="$REPLICATION_PASSWORD" \
+        pg_basebackup -h "$PRIMARY_HOST" -U replicator -D "$PGDATA" -R -X stream
+fi
+
+exec su-exec postgres postgres -c hot_standby=on